@@ -9,8 +9,130 @@ from matplotlib.animation import FuncAnimation
 import matplotlib.gridspec as gridspec
 from scipy import signal
 from scipy.io import wavfile
+from scipy import fft as sfft
+from scipy.fft import next_fast_len
+from numpy.lib.stride_tricks import sliding_window_view
 import os
+import platform
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from numba import njit, complex64
+    NUMBA_DISPONIBLE = True
+except ImportError:
+    NUMBA_DISPONIBLE = False
+
+
+def _suma_steering_numpy(X, S, out):
+    """Multiplica cada mic por su vector de steering y suma sobre mics"""
+    return np.einsum('mf,mf->f', X, S, out=out)
+
+
+if NUMBA_DISPONIBLE:
+    # Firma explícita (complex64 contiguo, 4 mics fijos): se compila al importar
+    # y LLVM puede desenrollar y vectorizar la reducción completa
+    @njit(complex64[::1](complex64[:, ::1], complex64[:, ::1], complex64[::1]),
+          cache=True, fastmath=True, nogil=True, boundscheck=False)
+    def _suma_steering(X, S, out):
+        """Multiplicación-suma compleja compilada para 4 mics, sin temporales y sin el GIL"""
+        for k in range(X.shape[1]):
+            out[k] = X[0, k] * S[0, k] + X[1, k] * S[1, k] + X[2, k] * S[2, k] + X[3, k] * S[3, k]
+        return out
+else:
+    _suma_steering = _suma_steering_numpy
+
+
+if NUMBA_DISPONIBLE:
+    @njit(cache=True, nogil=True, boundscheck=False)
+    def _cadena_post_beam(x, ganancia_base, cola, estado, umbral, exponente, coef_suave, sos, zi, out):
+        """Ganancia + compresor + pasabanda + limpieza en una sola pasada, sin temporales.
+        
+        Actualiza cola (envolvente) y zi (filtro) in situ; devuelve el nuevo estado del compresor.
+        """
+        n = x.shape[0]
+        m = cola.shape[0]          # ventana - 1
+        ventana = m + 1
+        n_sec = sos.shape[0]
+        
+        # Suma corrida de la ventana: empieza con la cola del bloque anterior
+        suma = 0.0
+        for j in range(m):
+            suma += cola[j]
+        
+        for i in range(n):
+            v = x[i] * ganancia_base
+            
+            # Media móvil de 100 muestras: entra la muestra actual, sale la más antigua
+            suma += abs(v)
+            env = suma / ventana
+            if i < m:
+                suma -= cola[i]
+            else:
+                suma -= abs(x[i - m] * ganancia_base)
+            
+            # Ganancia objetivo y suavizado de un polo
+            g = 1.0
+            if env > umbral:
+                g = (umbral / env) ** exponente
+            estado = coef_suave * estado + (1.0 - coef_suave) * g
+            y = v * estado
+            
+            # Biquads en forma directa II transpuesta (igual que sosfilt)
+            for s in range(n_sec):
+                b0 = sos[s, 0]
+                b1 = sos[s, 1]
+                b2 = sos[s, 2]
+                a1 = sos[s, 4]
+                a2 = sos[s, 5]
+                z0 = zi[s, 0]
+                z1 = zi[s, 1]
+                yo = b0 * y + z0
+                zi[s, 0] = b1 * y - a1 * yo + z1
+                zi[s, 1] = b2 * y - a2 * yo
+                y = yo
+            
+            if not np.isfinite(y):
+                y = 0.0
+            out[i] = y
+        
+        # Nueva cola: las últimas m muestras rectificadas (bloque anterior + actual)
+        for j in range(m):
+            k = n + j
+            if k < m:
+                cola[j] = cola[k]
+            else:
+                cola[j] = abs(x[k - m] * ganancia_base)
+        
+        return estado
+
+
+def _verificar_simd_numpy():
+    """Avisa si NumPy no dispone de las extensiones SIMD de la CPU en sus ufuncs"""
+    try:
+        from numpy._core._multiarray_umath import __cpu_features__
+    except ImportError:
+        try:
+            from numpy.core._multiarray_umath import __cpu_features__
+        except ImportError:
+            return
+    
+    maquina = platform.machine().lower()
+    if maquina in ('x86_64', 'amd64', 'i386', 'i686'):
+        requeridas = ['AVX2']
+    elif maquina in ('aarch64', 'arm64'):
+        requeridas = ['ASIMD']
+    else:
+        return
+    
+    faltantes = [f for f in requeridas if not __cpu_features__.get(f, False)]
+    if faltantes:
+        print(f"⚠️ NumPy sin soporte {', '.join(faltantes)} en esta CPU: "
+              f"el procesamiento será más lento (actualizar NumPy con pip)")
+    else:
+        extra = " + AVX512F" if __cpu_features__.get('AVX512F', False) else ""
+        print(f"✅ NumPy con SIMD: {requeridas[0]}{extra}")
 
 
 class BeamformingSystem:
@@ -46,17 +168,40 @@ class BeamformingSystem:
         self.ganancia_visual = 2.2
         self.umbral_compresor = 0.18
         self.ratio_compresion = 2.2
+        # Exponente de la ley de potencia del compresor: (umbral/nivel)^(1-1/ratio)
+        self.exponente_compresion = 1 - 1 / self.ratio_compresion
         
         # Buffers
         self.buffer_duration = 5
         self.buffer_size = self.buffer_duration * self.sample_rate
-        self.canal0_buffer = np.zeros(self.buffer_size)
-        self.beamformed_buffer = np.zeros(self.buffer_size)
-        self.beamformed_filtrado_buffer = np.zeros(self.buffer_size)
-        
-        # Audio para guardar
-        self.full_beamformed_audio = []
+        # float32: la precisión sobra para audio a 16 kHz y se reduce a la mitad el tráfico
+        self.canal0_buffer = np.zeros(self.buffer_size, dtype=np.float32)
+        self.beamformed_buffer = np.zeros(self.buffer_size, dtype=np.float32)
+        self.beamformed_filtrado_buffer = np.zeros(self.buffer_size, dtype=np.float32)
+        # Bloque de trabajo reutilizado para las 3 señales de visualización
+        self.bloque_visual = np.empty((3, self.blocksize), dtype=np.float32)
+        # Salida de la cadena post-beamforming fusionada (kernel numba)
+        self.bloque_procesado = np.empty(self.blocksize, dtype=np.float32)
+        # Bloque con la ganancia base aplicada (cadena NumPy, el compresor lo escala in situ)
+        self.bloque_ganancia = np.empty(self.blocksize, dtype=np.float32)
+        # Buffers circulares: posición de la próxima escritura (compartida)
+        self.write_idx = 0
+        # Marca de audio nuevo desde el último refresco de la gráfica
+        self.buffers_modificados = False
+        # (write_idx, spec_cursor) del último bloque completo, publicados juntos para la GUI
+        self.posiciones_visual = (0, 0)
+        
+        # Audio para guardar: buffer float32 que crece por duplicación
+        self.full_beamformed_audio = np.empty(self.sample_rate * 60, dtype=np.float32)
+        self.full_beamformed_len = 0
+        # El hilo del suscriptor acumula y la GUI guarda: buffer y cursor bajo el mismo lock
+        self.guardado_lock = threading.Lock()
         self.buffer_count = 0
+        # Monitor por consola desde el callback de audio
+        self.monitor_activo = True
+        self.monitor_cada_bloques = 40
+        # Un único hilo para escribir WAVs sin bloquear la GUI ni el audio
+        self.executor_guardado = ThreadPoolExecutor(max_workers=1)
         
         # Configuración
         self.output_folder = r"C:\Users\leona\Desktop\TLTech\PFJdN\Audios_Beamformed"
@@ -66,7 +211,20 @@ class BeamformingSystem:
         self.delays_precalculated = self._precalculate_all_delays_con_fracciones()
         
         # ✅ FILTRO PASABANDA 50Hz - 7000Hz (Orden 5)
-        self.filtro_pasabanda_b, self.filtro_pasabanda_a = self._crear_filtro_pasabanda()
+        # En secciones de segundo orden con estado persistente entre bloques
+        self.filtro_pasabanda_sos = self._crear_filtro_pasabanda()
+        self.filtro_pasabanda_zi = None
+        if self.filtro_pasabanda_sos is not None:
+            self.filtro_pasabanda_zi = np.zeros((self.filtro_pasabanda_sos.shape[0], 2), dtype=np.float32)
+        
+        # Delay-and-sum en frecuencia: tabla de steering y buffers de overlap-save
+        self._configurar_steering(self.blocksize)
+        
+        # Comprobar que las ufuncs de NumPy pueden usar SIMD en esta máquina
+        _verificar_simd_numpy()
+        
+        # Espectrograma incremental: ventana, escala y columnas circulares
+        self._configurar_espectrograma()
         
         # Visualización
         self.fig = None
@@ -74,15 +232,31 @@ class BeamformingSystem:
         self.lineas_temporales = [None, None, None]
         self.imagenes_espectrograma = [None, None, None]
         self.lineas_espectro = [None, None, None]
+        self.ylim_espectro = [None, None, None]
+        self.frames_plot = 0
+        self.clim_cada_frames = 15
+        # Límite de refresco: la GUI no necesita más de ~10 FPS
+        self.periodo_plot = 0.1
+        self.ultimo_plot_t = 0.0
         
         # BOTÓN
         self.btn_guardar = None
         
-        # Estado del compresor
+        # Estado del compresor (ganancia suavizada y últimas 99 muestras de la envolvente)
         self.compression_state = 1.0
+        self.envolvente_cola = np.zeros(99, dtype=np.float32)
+        
+        # Calentar el kernel de post-proceso (compilación o caché de numba) antes del primer
+        # bloque de audio; con copias del estado para no alterarlo
+        if NUMBA_DISPONIBLE and self.filtro_pasabanda_sos is not None:
+            _cadena_post_beam(
+                np.zeros(1, dtype=np.float32), self.ganancia_base, self.envolvente_cola.copy(), 1.0,
+                self.umbral_compresor, self.exponente_compresion, 0.99,
+                self.filtro_pasabanda_sos, self.filtro_pasabanda_zi.copy(), np.empty(1, dtype=np.float32)
+            )
         
         # Registro
-        self.gestion_audio.agregar_suscriptor(self.recibir_audio)
+        self.gestion_audio.agregar_suscriptor(self.recibir_audio, graba_audio=True)
         
         print("✅ BEAMFORMING OPTIMIZADO PARA DOA ULTRA ESTABLE")
         print("   - Filtro: 50Hz - 7000Hz (orden 5)")
@@ -100,70 +274,145 @@ class BeamformingSystem:
                 low_freq = 50.0 / nyquist
                 high_freq = 7000.0 / nyquist
             
-            b, a = signal.butter(5, [low_freq, high_freq], btype='band', analog=False)
+            sos = signal.butter(5, [low_freq, high_freq], btype='band', analog=False, output='sos')
             print(f"✅ Filtro pasabanda creado: 50Hz - 7000Hz, orden 5")
-            return b, a
+            return sos.astype(np.float32)
             
         except Exception as e:
             print(f"❌ Error creando filtro pasabanda: {e}")
-            return [1.0], [1.0]
+            return None
 
     def aplicar_filtro_pasabanda(self, señal):
         """Aplica el filtro pasabanda 50Hz-7000Hz"""
         try:
-            if len(self.filtro_pasabanda_b) == 1 and self.filtro_pasabanda_b[0] == 1.0:
+            if self.filtro_pasabanda_sos is None:
                 return señal
-            return signal.filtfilt(self.filtro_pasabanda_b, self.filtro_pasabanda_a, señal)
+            # Causal y continuo entre bloques: el estado zi pasa de un bloque al siguiente
+            filtrada, self.filtro_pasabanda_zi = signal.sosfilt(
+                self.filtro_pasabanda_sos, señal, zi=self.filtro_pasabanda_zi
+            )
+            return filtrada
         except Exception as e:
             print(f"⚠️ Error aplicando filtro pasabanda: {e}")
             return señal
 
+    def _configurar_espectrograma(self):
+        """Prepara ventana, escala y matrices del espectrograma incremental"""
+        self.spec_nperseg = 256
+        self.spec_hop = 256  # Sin solapamiento: 312 tramas bastan para 5 s en pantalla
+        self.spec_n_frames = (self.buffer_size - self.spec_nperseg) // self.spec_hop + 1
+        n_bins = self.spec_nperseg // 2 + 1
+        
+        # Misma ventana y escala de densidad que signal.spectrogram por defecto
+        ventana = signal.get_window(('tukey', 0.25), self.spec_nperseg)
+        escala = np.full(n_bins, 1.0 / (self.sample_rate * np.sum(ventana ** 2)))
+        escala[1:-1] *= 2  # Espectro de una cara (nperseg par: sin duplicar Nyquist)
+        self.spec_ventana = ventana.astype(np.float32)
+        self.spec_escala = escala.astype(np.float32)
+        self.spec_frecuencias = np.fft.rfftfreq(self.spec_nperseg, 1 / self.sample_rate)
+        # Espectro del buffer completo: ventana y eje de frecuencias constantes
+        self.espectro_ventana = np.hanning(self.buffer_size).astype(np.float32)
+        self.espectro_frecuencias = np.fft.rfftfreq(self.buffer_size, 1 / self.sample_rate)
+        self.buffers_plot = np.empty((3, self.buffer_size), dtype=np.float32)
+        # Salidas por frame de la GUI reservadas una vez: eje de tiempo, señales
+        # ventaneadas y magnitudes en dB
+        self.tiempo_plot = np.linspace(0, self.buffer_duration, self.buffer_size)
+        self.buffers_ventaneados = np.empty_like(self.buffers_plot)
+        self.magnitudes_plot = np.empty((3, self.buffer_size // 2 + 1), dtype=np.float32)
+        
+        # Espectrogramas circulares (señal, frecuencia, trama): solo se calculan las
+        # tramas nuevas de cada bloque; spec_cursor es la próxima columna a escribir
+        self.spec_columnas = np.zeros((3, n_bins, self.spec_n_frames), dtype=np.float32)
+        self.spec_cursor = 0
+        # Muestras que aún no completan una trama, por señal
+        self.spec_resto = np.zeros((3, 0), dtype=np.float32)
+        self.spec_imagen = np.empty((n_bins, self.spec_n_frames), dtype=np.float32)
+
+    def _actualizar_espectrogramas(self, bloques):
+        """Añade al espectrograma las tramas completas del bloque (3, n) recién llegado"""
+        datos = np.concatenate((self.spec_resto, bloques), axis=1)
+        n_tramas = 0
+        if datos.shape[1] >= self.spec_nperseg:
+            n_tramas = (datos.shape[1] - self.spec_nperseg) // self.spec_hop + 1
+        self.spec_resto = datos[:, n_tramas * self.spec_hop:].copy()
+        if n_tramas == 0:
+            return
+        
+        # (3, n_tramas, nperseg): sin detrend ni ventana todavía
+        tramas = sliding_window_view(datos, self.spec_nperseg, axis=1)[:, ::self.spec_hop][:, :n_tramas]
+        tramas = tramas - tramas.mean(axis=2, keepdims=True)
+        tramas *= self.spec_ventana
+        espectro = sfft.rfft(tramas, axis=2)
+        potencia = (espectro.real ** 2 + espectro.imag ** 2) * self.spec_escala
+        
+        # Escribir las columnas nuevas en la posición circular
+        n_tramas = min(n_tramas, self.spec_n_frames)
+        columnas = (self.spec_cursor + np.arange(n_tramas)) % self.spec_n_frames
+        self.spec_columnas[:, :, columnas] = potencia[:, -n_tramas:].transpose(0, 2, 1)
+        self.spec_cursor = (self.spec_cursor + n_tramas) % self.spec_n_frames
+
+    def _leer_espectrograma(self, senal, cursor=None):
+        """Espectrograma ordenado de la trama más antigua a la más reciente"""
+        c = self.spec_cursor if cursor is None else cursor
+        n = self.spec_n_frames - c
+        self.spec_imagen[:, :n] = self.spec_columnas[senal, :, c:]
+        self.spec_imagen[:, n:] = self.spec_columnas[senal, :, :c]
+        return self.spec_imagen
+
     def _precalculate_all_delays_con_fracciones(self):
         """Precalcula delays con parte fraccionaria"""
-        delays = np.zeros((360, 4, 2))
+        # Distancias proyectadas de los 4 mics para los 360 ángulos en un solo producto
+        angulos = np.deg2rad(np.arange(360))
+        direcciones = np.stack([np.cos(angulos), np.sin(angulos)], axis=1)
+        delay_samples = (direcciones @ self.mic_positions[:4].T) / self.sound_speed * self.sample_rate
         
-        for angle_deg in range(360):
-            angle_rad = np.deg2rad(angle_deg)
-            direction = np.array([np.cos(angle_rad), np.sin(angle_rad)])
-            
-            for mic in range(4):
-                distance = np.dot(self.mic_positions[mic], direction)
-                delay_seconds = distance / self.sound_speed
-                delay_samples = delay_seconds * self.sample_rate
-                
-                delays[angle_deg, mic, 0] = int(np.floor(delay_samples))
-                delays[angle_deg, mic, 1] = delay_samples - delays[angle_deg, mic, 0]
-            
-            min_delay = np.min(delays[angle_deg, :, 0])
-            delays[angle_deg, :, 0] -= min_delay
+        delays = np.zeros((360, 4, 2))
+        delays[:, :, 0] = np.floor(delay_samples)
+        delays[:, :, 1] = delay_samples - delays[:, :, 0]
+        delays[:, :, 0] -= delays[:, :, 0].min(axis=1, keepdims=True)
             
         return delays
 
+    def _configurar_steering(self, n_muestras):
+        """Prepara el delay-and-sum fraccionario en frecuencia para bloques de n_muestras"""
+        # Overlap-save: cada FFT ve el bloque nuevo precedido por la cola del anterior,
+        # así los retardos (y la cola del interpolador sinc) no dan la vuelta circularmente
+        self.steering_bloque = n_muestras
+        self.steering_nfft = next_fast_len(n_muestras + 64, real=True)
+        self.steering_historia = self.steering_nfft - n_muestras
+        # Latencia fija (muestras) para que la parte no causal del retardo fraccionario
+        # caiga dentro de la historia y no al final del bloque
+        self.steering_latencia = 16
+        
+        # Retardo total por ángulo y mic (entero + fracción), relativo al mic más adelantado
+        tau = self.delays_precalculated[:, :, 0] + self.delays_precalculated[:, :, 1]
+        tau = tau - tau.min(axis=1, keepdims=True) + self.steering_latencia
+        f = np.fft.rfftfreq(self.steering_nfft)  # ciclos por muestra
+        # (360, 4, n_bins): retardo + promedio de los 4 mics en un solo producto
+        self.steering = (0.25 * np.exp(-2j * np.pi * tau[:, :, np.newaxis] * f)).astype(np.complex64)
+        
+        self.bloque_extendido = np.zeros((4, self.steering_nfft), dtype=np.float32)
+        self.espectro_beam = np.empty(self.steering.shape[2], dtype=np.complex64)
+
     def apply_beamforming_optimized(self, audio_data, angle_deg, confidence):
-        """Beamforming OPTIMIZADO para DOA estable"""
-        # ✅ USAR SOLO DELAYS ENTEROS (más estable)
-        angle_deg_int = int(angle_deg) % 360
-        delays = self.delays_precalculated[angle_deg_int]
-        
-        max_delay = int(np.max(delays[:, 0]))
-        output_length = len(audio_data) + max_delay
-        
-        beamformed = np.zeros(output_length)
-        weights = np.zeros(output_length)
-        
-        for mic in range(4):
-            delay_int = int(delays[mic, 0])
-            
-            start_idx = delay_int
-            end_idx = start_idx + len(audio_data)
-            
-            if end_idx <= output_length:
-                beamformed[start_idx:end_idx] += audio_data[:, mic]
-                weights[start_idx:end_idx] += 1.0
-        
-        weights[weights == 0] = 1.0
-        beamformed = beamformed / weights
-        beamformed = beamformed[:len(audio_data)]
+        """Beamforming OPTIMIZADO para DOA estable (audio_data: mics x muestras)"""
+        # Índice directo en la tabla de steering: ángulo entero más cercano, sin copias
+        angle_deg_int = int(angle_deg + 0.5) % 360
+        n = audio_data.shape[1]
+        if n != self.steering_bloque:
+            self._configurar_steering(n)
+        
+        # Desplazar la historia y añadir el bloque nuevo al final
+        h = self.steering_historia
+        ext = self.bloque_extendido
+        ext[:, :h] = ext[:, n:]
+        ext[:, h:] = audio_data
+        
+        # Retardos fraccionarios: una FFT real por mic y una multiplicación-suma compleja
+        # (scipy.fft conserva complex64 con cualquier versión de NumPy)
+        X = sfft.rfft(ext, axis=1)
+        Y = _suma_steering(X, self.steering[angle_deg_int], self.espectro_beam)
+        beamformed = sfft.irfft(Y, n=self.steering_nfft)[-n:]
         
         # ✅ GANANCIA ADAPTATIVA SEGÚN CONFIANZA DOA
         adaptive_gain = 1.0
@@ -185,51 +434,77 @@ class BeamformingSystem:
         if self.consecutive_stable_frames > 20:
             adaptive_gain *= 1.1  # Pequeño bonus por estabilidad
         
-        beamformed = beamformed * adaptive_gain
+        # El bloque sale de la irfft y es propio: se escala in situ
+        beamformed *= adaptive_gain
         
         # ✅ NORMALIZACIÓN CONSERVADORA
         max_val = np.max(np.abs(beamformed))
         if max_val > 0.25:
-            beamformed = beamformed * (0.25 / max_val)
+            beamformed *= 0.25 / max_val
         
         return beamformed
 
-    def aplicar_compresor_optimizado(self, señal, umbral=0.18, ratio=2.2):
-        """Compresor OPTIMIZADO para señales estables"""
-        señal_comprimida = np.zeros_like(señal)
-        
+    def aplicar_compresor_optimizado(self, señal):
+        """Compresor OPTIMIZADO para señales estables (vectorizado)"""
+        # Mismos parámetros que el kernel fusionado: umbral y exponente del sistema
+        umbral = self.umbral_compresor
         # ✅ VENTANA MÁS LARGA PARA MÁS SUAVIDAD
+        # Media móvil de 100 muestras por suma acumulada (O(N)); la cola del bloque
+        # anterior continúa la ventana y evita el transitorio al inicio de cada bloque
         window_size = 100
-        envelope = np.convolve(np.abs(señal), np.ones(window_size)/window_size, mode='same')
-        
-        for i in range(len(señal)):
-            nivel = envelope[i]
-            
-            if nivel > umbral:
-                exceso_db = 20 * np.log10(nivel / umbral)
-                reduccion_db = exceso_db * (1 - 1/ratio)
-                ganancia_objetivo = 10 ** (-reduccion_db / 20)
-            else:
-                ganancia_objetivo = 1.0
-            
-            # ✅ SUAVIDAD EXTREMA EN CAMBIOS
-            self.compression_state = 0.99 * self.compression_state + 0.01 * ganancia_objetivo
-            señal_comprimida[i] = señal[i] * self.compression_state
-        
-        return señal_comprimida
+        abs_ext = np.concatenate((self.envolvente_cola, np.abs(señal)))
+        csum = np.empty(len(abs_ext) + 1)
+        csum[0] = 0.0
+        np.cumsum(abs_ext, out=csum[1:])
+        envelope = ((csum[window_size:] - csum[:-window_size]) * (1 / window_size)).astype(np.float32)
+        self.envolvente_cola = abs_ext[-(window_size - 1):]
+        
+        # Ganancia objetivo: (umbral/nivel)^(1-1/ratio) por encima del umbral, 1 por debajo
+        # (equivale a reducir el exceso en dB por (1-1/ratio), sin log10 ni potencias de 10)
+        ganancia_objetivo = np.ones_like(envelope)
+        mask = envelope > umbral
+        ganancia_objetivo[mask] = (umbral / envelope[mask]) ** self.exponente_compresion
+        
+        # ✅ SUAVIDAD EXTREMA EN CAMBIOS: estado = 0.99*estado + 0.01*objetivo, en C con lfilter
+        ganancia, _ = signal.lfilter([0.01], [1.0, -0.99], ganancia_objetivo,
+                                     zi=[0.99 * self.compression_state])
+        self.compression_state = float(ganancia[-1])
+        
+        # Aplicar in situ: la señal de entrada es un bloque de trabajo propio
+        np.multiply(señal, ganancia, out=señal, casting='unsafe')
+        return señal
 
-    def suavizar_transicion_minima(self, señal, muestras_suavizado=32):
-        """Suavizado MÍNIMO - DOA ya es estable"""
-        if len(señal) < muestras_suavizado * 2:
-            return señal
-            
-        señal_suavizada = señal.copy()
-        
-        # ✅ SOLO SUAVIDAD EN BORDES (menos procesamiento)
-        ventana_final = 0.5 - 0.5 * np.cos(np.linspace(np.pi, 0, muestras_suavizado))
-        señal_suavizada[-muestras_suavizado:] *= ventana_final
-        
-        return señal_suavizada
+    def _escribir_circular(self, buffer, datos):
+        """Escribe un bloque en el buffer circular a partir de write_idx"""
+        n = len(datos)
+        fin = self.write_idx + n
+        if fin <= self.buffer_size:
+            buffer[self.write_idx:fin] = datos
+        else:
+            corte = self.buffer_size - self.write_idx
+            buffer[self.write_idx:] = datos[:corte]
+            buffer[:n - corte] = datos[corte:]
+
+    def _leer_circular(self, buffer, idx, out=None):
+        """Devuelve el buffer circular ordenado de la muestra más antigua a la más reciente"""
+        if out is None:
+            return np.concatenate((buffer[idx:], buffer[:idx]))
+        n = len(buffer) - idx
+        out[:n] = buffer[idx:]
+        out[n:] = buffer[:idx]
+        return out
+
+    def _acumular_audio_guardado(self, bloque):
+        """Añade un bloque al audio a guardar, duplicando la capacidad si hace falta"""
+        n = len(bloque)
+        with self.guardado_lock:
+            fin = self.full_beamformed_len + n
+            if fin > len(self.full_beamformed_audio):
+                nuevo = np.empty(max(2 * len(self.full_beamformed_audio), fin), dtype=np.float32)
+                nuevo[:self.full_beamformed_len] = self.full_beamformed_audio[:self.full_beamformed_len]
+                self.full_beamformed_audio = nuevo
+            self.full_beamformed_audio[self.full_beamformed_len:fin] = bloque
+            self.full_beamformed_len = fin
 
     def recibir_audio(self, audio_data):
         """Callback OPTIMIZADO para DOA estable"""
@@ -238,15 +513,16 @@ class BeamformingSystem:
             
         try:
             if audio_data.shape[1] >= 6:
-                canal0_signal = audio_data[:, 0].copy()
-                
-                self.canal0_buffer = np.roll(self.canal0_buffer, -len(canal0_signal))
-                self.canal0_buffer[-len(canal0_signal):] = canal0_signal
+                # Todo el procesamiento en float32 (sin copia si ya lo es)
+                audio_data = audio_data.astype(np.float32, copy=False)
+                # Vistas de solo lectura: no hace falta copiar el bloque
+                canal0_signal = audio_data[:, 0]
                 
                 # ✅ DOA YA VIENE ESTABLE - SOLO USAR ÁNGULO
                 self.current_angle, self.angle_confidence = self.doa.get_angulo_actual()
                 
-                mic_data = audio_data[:, 1:5].copy()
+                # Un canal por fila (mics x muestras); vista, se copia al buffer de overlap-save
+                mic_data = audio_data[:, 1:5].T
                 
                 # ✅ BEAMFORMING CON CONFIANZA INTEGRADA
                 beamformed = self.apply_beamforming_optimized(
@@ -254,37 +530,60 @@ class BeamformingSystem:
                 )
                 
                 # ✅ CADENA DE PROCESAMIENTO SIMPLIFICADA
-                beamformed_ganancia = beamformed * self.ganancia_base
-                beamformed_comprimido = self.aplicar_compresor_optimizado(beamformed_ganancia)
-                beamformed_filtrado = self.aplicar_filtro_pasabanda(beamformed_comprimido)
-                beamformed_final = self.suavizar_transicion_minima(beamformed_filtrado, 32)
-                
-                # Limpieza de datos
-                beamformed_final = np.nan_to_num(beamformed_final, nan=0.0, posinf=0.0, neginf=0.0)
+                if NUMBA_DISPONIBLE and self.filtro_pasabanda_sos is not None:
+                    # Ganancia, compresor, filtro y limpieza fusionados en un kernel compilado
+                    if self.bloque_procesado.shape[0] != len(beamformed):
+                        self.bloque_procesado = np.empty(len(beamformed), dtype=np.float32)
+                    self.compression_state = _cadena_post_beam(
+                        beamformed, self.ganancia_base, self.envolvente_cola, self.compression_state,
+                        self.umbral_compresor, self.exponente_compresion, 0.99,
+                        self.filtro_pasabanda_sos, self.filtro_pasabanda_zi, self.bloque_procesado
+                    )
+                    beamformed_filtrado = beamformed_final = self.bloque_procesado
+                else:
+                    if self.bloque_ganancia.shape[0] != len(beamformed):
+                        self.bloque_ganancia = np.empty(len(beamformed), dtype=np.float32)
+                    beamformed_ganancia = np.multiply(beamformed, self.ganancia_base, out=self.bloque_ganancia)
+                    beamformed_comprimido = self.aplicar_compresor_optimizado(beamformed_ganancia)
+                    beamformed_filtrado = self.aplicar_filtro_pasabanda(beamformed_comprimido)
+                    
+                    # Limpieza de datos solo si hace falta: una reducción sin escritura detecta
+                    # NaN/inf y la reparación in situ únicamente corre en ese caso
+                    beamformed_final = beamformed_filtrado
+                    if not np.isfinite(np.dot(beamformed_filtrado, beamformed_filtrado)):
+                        np.nan_to_num(beamformed_filtrado, copy=False, nan=0.0, posinf=0.0, neginf=0.0)
                 
                 # ✅ GUARDAR AUDIO
-                self.full_beamformed_audio.append(beamformed_final.copy())
+                self._acumular_audio_guardado(beamformed_final)
                 self.buffer_count += 1
                 
-                # Para visualización
-                beamformed_visual = beamformed * self.ganancia_visual
-                beamformed_visual = np.clip(beamformed_visual, -1.0, 1.0)
+                # Para visualización: las 3 señales en un bloque (3, n) preasignado
+                if self.bloque_visual.shape[1] != len(canal0_signal):
+                    self.bloque_visual = np.empty((3, len(canal0_signal)), dtype=np.float32)
+                visual = self.bloque_visual
+                visual[0] = canal0_signal
+                np.multiply(beamformed, self.ganancia_visual, out=visual[1])
+                np.multiply(beamformed_filtrado, self.ganancia_visual, out=visual[2])
+                np.clip(visual[1:], -1.0, 1.0, out=visual[1:])
                 
-                beamformed_filtrado_visual = beamformed_filtrado * self.ganancia_visual
-                beamformed_filtrado_visual = np.clip(beamformed_filtrado_visual, -1.0, 1.0)
+                # Actualizar buffers de visualización (escritura circular, sin np.roll)
+                self._escribir_circular(self.canal0_buffer, visual[0])
+                self._escribir_circular(self.beamformed_buffer, visual[1])
+                self._escribir_circular(self.beamformed_filtrado_buffer, visual[2])
+                self.write_idx = (self.write_idx + len(canal0_signal)) % self.buffer_size
+                self.buffers_modificados = True
                 
-                # Actualizar buffers de visualización
-                self.beamformed_buffer = np.roll(self.beamformed_buffer, -len(beamformed_visual))
-                self.beamformed_buffer[-len(beamformed_visual):] = beamformed_visual
+                # Solo las tramas nuevas del espectrograma (pocas FFT cortas por bloque)
+                self._actualizar_espectrogramas(visual)
                 
-                self.beamformed_filtrado_buffer = np.roll(
-                    self.beamformed_filtrado_buffer, -len(beamformed_filtrado_visual)
-                )
-                self.beamformed_filtrado_buffer[-len(beamformed_filtrado_visual):] = beamformed_filtrado_visual
+                # Publicar las posiciones de lectura de una vez (asignación atómica):
+                # la GUI lee siempre un par coherente sin usar locks
+                self.posiciones_visual = (self.write_idx, self.spec_cursor)
                 
-                # ✅ MONITOREO MEJORADO
-                if self.buffer_count % 40 == 0:
-                    rms_beam = np.sqrt(np.mean(beamformed_final**2))
+                # ✅ MONITOREO MEJORADO (print en el hilo de audio: desactivable, y
+                # eliminado por completo con python -O)
+                if __debug__ and self.monitor_activo and self.buffer_count % self.monitor_cada_bloques == 0:
+                    rms_beam = np.sqrt(np.dot(beamformed_final, beamformed_final) / beamformed_final.size)
                     stability = "⚡" if self.consecutive_stable_frames > 20 else ""
                     print(f"🎯 Beam - Ángulo: {self.current_angle}° "
                           f"Conf: {self.angle_confidence:.2f} "
@@ -294,21 +593,54 @@ class BeamformingSystem:
             print(f"❌ Error en beamforming: {e}")
 
     def guardar_audio_beamformed(self, event=None):
-        """Guardado con información de estabilidad"""
-        if len(self.full_beamformed_audio) == 0:
+        """Guardado con información de estabilidad (la escritura se hace en segundo plano)"""
+        if self.full_beamformed_len == 0:
             print("❌ No hay datos de audio para guardar")
-            return
+            return None
 
         try:
             print("💾 Guardando audio beamformed...")
-            audio_data = np.concatenate(self.full_beamformed_audio, axis=0)
+            # Se toma el buffer lleno y se deja uno nuevo en un solo paso bajo el lock:
+            # la grabación sigue en el nuevo mientras se escribe, sin perder ni repetir bloques
+            with self.guardado_lock:
+                audio_data = self.full_beamformed_audio[:self.full_beamformed_len]
+                self.full_beamformed_audio = np.empty(self.sample_rate * 60, dtype=np.float32)
+                self.full_beamformed_len = 0
+            angulo_final = self.current_angle
+            frames_estables = self.consecutive_stable_frames
+            self.buffer_count = 0
             
+            return self.executor_guardado.submit(
+                self._escribir_audio_guardado, audio_data, angulo_final, frames_estables
+            )
+            
+        except Exception as e:
+            print(f"❌ Error guardando audio: {e}")
+            return None
+
+    def _convertir_a_int16(self, audio_data, muestras_bloque=262144):
+        """Escala, satura, redondea y convierte a int16 por bloques de ~1 MB (sin desbordes)"""
+        audio_int16 = np.empty(len(audio_data), dtype=np.int16)
+        tmp = np.empty(min(muestras_bloque, len(audio_data)), dtype=np.float32)
+        
+        for inicio in range(0, len(audio_data), muestras_bloque):
+            bloque = audio_data[inicio:inicio + muestras_bloque]
+            t = tmp[:len(bloque)]
+            np.multiply(bloque, 32767.0, out=t)
+            np.clip(t, -32768.0, 32767.0, out=t)
+            np.rint(t, out=t)  # Redondeo al entero más cercano en lugar de truncar
+            audio_int16[inicio:inicio + len(bloque)] = t
+        return audio_int16
+
+    def _escribir_audio_guardado(self, audio_data, angulo_final, frames_estables):
+        """Normaliza, convierte a int16 y escribe el WAV (hilo de guardado)"""
+        try:
             max_val = np.max(np.abs(audio_data))
             print(f"📊 Máximo en grabación: {max_val:.4f}")
             
             if max_val > 0.8:
                 factor_ajuste = 0.8 / max_val
-                audio_data = audio_data * factor_ajuste
+                audio_data *= factor_ajuste
                 print(f"   🔧 Ajuste aplicado: {factor_ajuste:.3f}x")
             
             # Fade out suave
@@ -317,7 +649,7 @@ class BeamformingSystem:
                 fade_out = 0.5 - 0.5 * np.cos(np.linspace(np.pi, 0, fade_samples))
                 audio_data[-fade_samples:] *= fade_out
             
-            audio_int16 = np.int16(audio_data * 32767)
+            audio_int16 = self._convertir_a_int16(audio_data)
             
             timestamp = time.strftime("%Y%m%d_%H%M%S")
             filename = f"beamformed_estable_{timestamp}.wav"
@@ -328,11 +660,8 @@ class BeamformingSystem:
             duracion = len(audio_data) / self.sample_rate
             print(f"✅ AUDIO GUARDADO: {filepath}")
             print(f"   Duración: {duracion:.2f}s")
-            print(f"   Ángulo final: {self.current_angle}°")
-            print(f"   Frames estables: {self.consecutive_stable_frames}")
-            
-            self.full_beamformed_audio = []
-            self.buffer_count = 0
+            print(f"   Ángulo final: {angulo_final}°")
+            print(f"   Frames estables: {frames_estables}")
             
         except Exception as e:
             print(f"❌ Error guardando audio: {e}")
@@ -376,25 +705,26 @@ class BeamformingSystem:
                         self.axes[row, col].set_xlim(0, 8000)
                         self.axes[row, col].grid(True, alpha=0.3)
             
-            tiempo = np.linspace(0, self.buffer_duration, self.buffer_size)
             colores = ['blue', 'green', 'red']
             
             for col in range(3):
                 self.lineas_temporales[col], = self.axes[1, col].plot(
-                    tiempo, np.zeros(self.buffer_size), 
+                    self.tiempo_plot, np.zeros(self.buffer_size), 
                     color=colores[col], linewidth=1.0
                 )
             
+            # El extent es fijo (buffer y nperseg constantes): se fija una sola vez
+            f = self.spec_frecuencias
             for col in range(3):
                 empty_spec = np.zeros((100, 100))
                 self.imagenes_espectrograma[col] = self.axes[0, col].imshow(
                     empty_spec, aspect='auto', cmap='viridis',
-                    origin='lower', extent=[0, self.buffer_duration, 0, 8000]
+                    origin='lower', extent=[0, self.buffer_duration, f[0], f[-1]]
                 )
                 if col == 2:
                     plt.colorbar(self.imagenes_espectrograma[col], ax=self.axes[0, col])
             
-            frecuencias = np.fft.rfftfreq(self.buffer_size, 1/self.sample_rate)
+            frecuencias = self.espectro_frecuencias
             for col in range(3):
                 self.lineas_espectro[col], = self.axes[2, col].plot(
                     frecuencias, np.zeros_like(frecuencias) - 60,
@@ -422,40 +752,77 @@ class BeamformingSystem:
         if not self.is_active:
             return []
         
+        # Sin audio nuevo o con un refresco demasiado reciente, mantener las imágenes actuales
+        ahora = time.monotonic()
+        if not self.buffers_modificados or ahora - self.ultimo_plot_t < self.periodo_plot:
+            return (list(self.lineas_temporales) + list(self.imagenes_espectrograma) +
+                    list(self.lineas_espectro))
+        self.ultimo_plot_t = ahora
+        self.buffers_modificados = False
+        
         try:
-            buffers = [
-                self.canal0_buffer,
-                self.beamformed_buffer,
-                self.beamformed_filtrado_buffer
-            ]
-            
-            tiempo = np.linspace(0, self.buffer_duration, self.buffer_size)
+            # Desenrollar los buffers circulares una sola vez por frame, en un bloque (3, N),
+            # a partir de las últimas posiciones publicadas por el callback
+            idx, cursor_spec = self.posiciones_visual
+            buffers = self.buffers_plot
+            self._leer_circular(self.canal0_buffer, idx, out=buffers[0])
+            self._leer_circular(self.beamformed_buffer, idx, out=buffers[1])
+            self._leer_circular(self.beamformed_filtrado_buffer, idx, out=buffers[2])
+            
+            # Los tres espectros en una sola FFT por lotes, repartida entre hilos
+            np.multiply(buffers, self.espectro_ventana, out=self.buffers_ventaneados)
+            espectros = sfft.rfft(self.buffers_ventaneados, axis=1, workers=-1)
+            # Magnitud en dB in situ sobre el buffer reservado
+            magnitudes = np.abs(espectros, out=self.magnitudes_plot)
+            magnitudes += 1e-8
+            np.log10(magnitudes, out=magnitudes)
+            magnitudes *= 20
+            
+            # La escala de color se recalcula cada pocos frames, y siempre con un redibujo
+            # completo: la barra de color no está entre los artistas del blitting
+            redibujar = self.frames_plot % self.clim_cada_frames == 0
+            self.frames_plot += 1
+            espectrogramas = []
             
             for col in range(3):
                 buffer_actual = buffers[col]
                 
-                self.lineas_temporales[col].set_data(tiempo, buffer_actual)
+                # El eje de tiempo es fijo: solo se actualiza la amplitud
+                self.lineas_temporales[col].set_ydata(buffer_actual)
                 
-                if len(buffer_actual) >= 256:
-                    f, t, Sxx = signal.spectrogram(buffer_actual, self.sample_rate, 
-                                                  nperseg=256, noverlap=128)
-                    if Sxx.size > 0:
-                        self.imagenes_espectrograma[col].set_data(Sxx)
-                        self.imagenes_espectrograma[col].set_extent([0, self.buffer_duration, f[0], f[-1]])
-                        self.imagenes_espectrograma[col].set_clim(
-                            vmin=np.percentile(Sxx, 10), 
-                            vmax=np.percentile(Sxx, 90)
-                        )
+                # Espectrograma ya actualizado por el callback: solo desenrollar y pintar
+                Sxx = self._leer_espectrograma(col, cursor_spec)
+                self.imagenes_espectrograma[col].set_data(Sxx)
+                espectrogramas.append(Sxx)
                 
-                fft_signal = np.fft.rfft(buffer_actual * np.hanning(len(buffer_actual)))
-                fft_magnitude = 20 * np.log10(np.abs(fft_signal) + 1e-8)
-                frecuencias = np.fft.rfftfreq(len(buffer_actual), 1/self.sample_rate)
+                fft_magnitude = magnitudes[col]
                 
-                self.lineas_espectro[col].set_data(frecuencias, fft_magnitude)
-                self.axes[2, col].set_ylim(
-                    np.min(fft_magnitude) - 5, 
-                    np.max(fft_magnitude) + 5
-                )
+                # El eje de frecuencias no cambia: solo se actualiza la magnitud
+                self.lineas_espectro[col].set_ydata(fft_magnitude)
+                
+                # Con blitting los ejes no se redibujan: ajustar ylim solo si el
+                # espectro se sale del rango o este sobra mucho (histéresis)
+                minimo = np.min(fft_magnitude) - 5
+                maximo = np.max(fft_magnitude) + 5
+                actual = self.ylim_espectro[col]
+                if (actual is None or minimo < actual[0] or maximo > actual[1] or
+                        (actual[1] - actual[0]) - (maximo - minimo) > 20):
+                    self.ylim_espectro[col] = (minimo - 5, maximo + 5)
+                    self.axes[2, col].set_ylim(*self.ylim_espectro[col])
+                    redibujar = True
+            
+            if redibujar:
+                # Escala de color: percentiles 10/90 sobre 1 de cada 4 píxeles
+                # con np.partition (O(N), sin ordenar)
+                for imagen, Sxx in zip(self.imagenes_espectrograma, espectrogramas):
+                    muestra = Sxx[::2, ::2].ravel()
+                    bajo, alto = int(0.1 * (muestra.size - 1)), int(0.9 * (muestra.size - 1))
+                    muestra.partition((bajo, alto))
+                    imagen.set_clim(vmin=muestra[bajo], vmax=muestra[alto])
+                # Redibujo completo síncrono (no draw_idle): actualiza la barra de color y,
+                # como los artistas animados no se pintan, FuncAnimation copia el fondo de
+                # un canvas limpio y no del frame anterior con la línea vieja
+                self.fig.canvas.draw()
             
             todos_elementos = (
                 list(self.lineas_temporales) + 
@@ -477,7 +844,11 @@ class BeamformingSystem:
         self.is_processing = True
         self.buffer_count = 0
         self.compression_state = 1.0
+        self.envolvente_cola = np.zeros(99, dtype=np.float32)
         self.consecutive_stable_frames = 0
+        self.bloque_extendido.fill(0)
+        if self.filtro_pasabanda_zi is not None:
+            self.filtro_pasabanda_zi.fill(0)
         
         print("✅ BEAMFORMING OPTIMIZADO ACTIVADO")
         print("   - Adaptado a DOA ultra estable")
@@ -486,7 +857,7 @@ class BeamformingSystem:
 
     def detener_beamforming(self):
         """Detiene el beamforming"""
-        if len(self.full_beamformed_audio) > 0:
+        if self.full_beamformed_len > 0:
             self.guardar_audio_beamformed()
         
         self.is_processing = False
@@ -19,8 +19,11 @@ class CalibradorDOA:
         print(f"   • Distancia: 1-2 metros")
         print("   • Presiona Ctrl+C para cancelar\n")
         
-        angulos_recolectados = []
-        confianzas_recolectadas = []
+        # Buffers preasignados: una muestra cada 0.5 s
+        max_muestras = int(duracion / 0.5) + 1
+        angulos_recolectados = np.empty(max_muestras)
+        confianzas_recolectadas = np.empty(max_muestras)
+        n_muestras = 0
         
         print("🔄 Recolectando datos...", end='', flush=True)
         
@@ -28,9 +31,10 @@ class CalibradorDOA:
         try:
             while time.time() - start_time < duracion:
                 angulo, confianza = self.doa.get_angulo_actual()
-                if confianza > 0.4:  # Solo datos confiables
-                    angulos_recolectados.append(angulo)
-                    confianzas_recolectadas.append(confianza)
+                if confianza > 0.4 and n_muestras < max_muestras:  # Solo datos confiables
+                    angulos_recolectados[n_muestras] = angulo
+                    confianzas_recolectadas[n_muestras] = confianza
+                    n_muestras += 1
                 print(".", end='', flush=True)
                 time.sleep(0.5)
                 
@@ -40,7 +44,7 @@ class CalibradorDOA:
         
         print("✅")
         
-        if not angulos_recolectados:
+        if n_muestras == 0:
             print("❌ No se capturaron datos válidos")
             print("   Verifica:")
             print("   - Volumen de la fuente")
@@ -49,14 +53,11 @@ class CalibradorDOA:
             return None
         
         # Calcular error sistemático
-        angulos = np.array(angulos_recolectados)
-        errores = []
-        for angulo in angulos:
-            error = (angulo - angulo_real + 180) % 360 - 180
-            errores.append(error)
+        angulos = angulos_recolectados[:n_muestras]
+        errores = ((angulos - angulo_real + 180) % 360) - 180
         
-        error_mediano = np.median(errores)
-        desviacion = np.std(errores)
+        error_mediano = float(np.median(errores))
+        desviacion = float(np.std(errores))
         
         print(f"📊 Análisis:")
         print(f"   • Muestras: {len(angulos)}")
@@ -2,15 +2,103 @@
 DOA.py - Direction of Arrival SRP-PHAT CORREGIDO
 """
 
+import os
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.animation import FuncAnimation
 from matplotlib.widgets import Button
 from scipy import signal
+from scipy import fft as sfft
+from collections import deque
+from bisect import insort, bisect_left
+
+try:
+    from numba import njit, prange, set_num_threads, float32, intp, void, config as numba_config
+    NUMBA_DISPONIBLE = True
+except ImportError:
+    NUMBA_DISPONIBLE = False
+
+
+def _potencias_srp_numpy(fft_re, fft_im, mic1, mic2, steering_re, steering_im, nr, ni, pots):
+    """Potencia SRP-PHAT de todos los ángulos con NumPy (fft_re/fft_im: mics x frecuencias)"""
+    # Espectro cruzado X1·conj(X2) en aritmética real: (pares, frecuencias)
+    cr = fft_re[mic1] * fft_re[mic2] + fft_im[mic1] * fft_im[mic2]
+    ci = fft_im[mic1] * fft_re[mic2] - fft_re[mic1] * fft_im[mic2]
+    # PHAT sin ramas: un recíproco con épsilon (los bins nulos quedan en 0)
+    inv_magnitudes = np.hypot(cr, ci)
+    inv_magnitudes += 1e-12
+    np.reciprocal(inv_magnitudes, out=inv_magnitudes)
+    np.multiply(cr, inv_magnitudes, out=nr)
+    np.multiply(ci, inv_magnitudes, out=ni)
+    # Re(sum_{p,f} cross_phat · steering) = sum(nr·cos - ni·sin): dos GEMV de BLAS sobre
+    # las tablas aplanadas a (ángulos, pares·frecuencias), vistas sin copia
+    n_ang = steering_re.shape[0]
+    np.matmul(steering_re.reshape(n_ang, -1), nr.ravel(), out=pots)
+    pots -= steering_im.reshape(n_ang, -1) @ ni.ravel()
+    return pots
+
+
+if NUMBA_DISPONIBLE:
+    # Firmas explícitas (float32 contiguo, índices intp): se compilan al importar y
+    # el layout C conocido permite a LLVM vectorizar los bucles internos sin comprobaciones
+    _FIRMA_SRP = float32[::1](float32[:, ::1], float32[:, ::1], intp[::1], intp[::1],
+                              float32[:, :, ::1], float32[:, :, ::1],
+                              float32[:, ::1], float32[:, ::1], float32[::1])
+
+    @njit(void(float32[:, ::1], float32[:, ::1], intp[::1], intp[::1], float32[:, ::1], float32[:, ::1]),
+          cache=True, fastmath=True, nogil=True, boundscheck=False)
+    def _phat_pares(fft_re, fft_im, mic1, mic2, nr, ni):
+        """Espectros cruzados PHAT de cada par, en float32 separados (pares, frecuencias)"""
+        n_pares, n_frec = nr.shape
+        for p in range(n_pares):
+            m1 = mic1[p]
+            m2 = mic2[p]
+            for f in range(n_frec):
+                cr = fft_re[m1, f] * fft_re[m2, f] + fft_im[m1, f] * fft_im[m2, f]
+                ci = fft_im[m1, f] * fft_re[m2, f] - fft_re[m1, f] * fft_im[m2, f]
+                # PHAT sin ramas: un recíproco con épsilon (los bins nulos quedan en 0)
+                inv = 1.0 / (np.sqrt(cr * cr + ci * ci) + 1e-12)
+                nr[p, f] = cr * inv
+                ni[p, f] = ci * inv
+
+    @njit(_FIRMA_SRP, cache=True, fastmath=True, nogil=True, boundscheck=False)
+    def _potencias_srp(fft_re, fft_im, mic1, mic2, steering_re, steering_im, nr, ni, pots):
+        """Potencia SRP-PHAT compilada: PHAT y reducción por ángulo en un solo bucle"""
+        n_ang, n_pares, n_frec = steering_re.shape
+        _phat_pares(fft_re, fft_im, mic1, mic2, nr, ni)
+        
+        # Cuatro multiplicaciones reales por (par, frecuencia): LLVM las vectoriza con FMA
+        for a in range(n_ang):
+            acc = 0.0
+            for p in range(n_pares):
+                for f in range(n_frec):
+                    acc += nr[p, f] * steering_re[a, p, f] - ni[p, f] * steering_im[a, p, f]
+            pots[a] = acc
+        return pots
+
+    # Sin firma: se compila en el primer uso, solo si la rejilla de ángulos lo justifica
+    @njit(parallel=True, cache=True, fastmath=True, nogil=True, boundscheck=False)
+    def _potencias_srp_paralelo(fft_re, fft_im, mic1, mic2, steering_re, steering_im, nr, ni, pots):
+        """Como _potencias_srp, con los ángulos repartidos entre núcleos (rejillas finas)"""
+        n_ang, n_pares, n_frec = steering_re.shape
+        # El PHAT se calcula antes, en un solo hilo; los hilos solo lo leen
+        _phat_pares(fft_re, fft_im, mic1, mic2, nr, ni)
+        
+        for a in prange(n_ang):
+            acc = 0.0
+            for p in range(n_pares):
+                for f in range(n_frec):
+                    acc += nr[p, f] * steering_re[a, p, f] - ni[p, f] * steering_im[a, p, f]
+            pots[a] = acc
+        return pots
+else:
+    _potencias_srp = _potencias_srp_numpy
+    _potencias_srp_paralelo = _potencias_srp_numpy
 
 class DOA:
-    def __init__(self, gestion_audio):
+    def __init__(self, gestion_audio, enable_gui=True):
         self.gestion_audio = gestion_audio
+        self.enable_gui = enable_gui
         
         # Configuración geométrica
         self.radio = 0.0325
@@ -45,22 +133,27 @@ class DOA:
         self.frec_max = 3000
         
         # Buffers para suavizado
-        self.buffer_angulos = []
         self.buffer_size = 8
+        self.buffer_angulos = deque(maxlen=self.buffer_size)
+        # Los mismos ángulos mantenidos ordenados para la mediana incremental
+        self.angulos_ordenados = []
         
         # Pre-cálculos
+        self.configurar_buffers_frame(self.blocksize)
         self.delays = self.delays_precalculados()
         self.precalcular_frecuencias()
-        
-        # Estado de búsqueda
-        self.fase_gruesa = False
-        self.angulo_grueso = 0
+        self.precalcular_pares()
         
         # Registrarse para recibir audio
         self.gestion_audio.agregar_suscriptor(self.recibir_audio)
         
         # Configurar gráfica
-        self.setup_grafica_polar()
+        self.colores_confianza = ['red', 'orange', 'green']
+        # (ángulo, banda de confianza, confianza redondeada) del último frame dibujado
+        self.ultimo_estado_plot = None
+        self.fig = None
+        if self.enable_gui:
+            self.setup_grafica_polar()
         
         print("DOA inicializado - MODO ESTABLE")
 
@@ -68,105 +161,114 @@ class DOA:
         """Callback que recibe audio del gestor central"""
         if self.is_active and audio_data is not None:
             try:
-                # Usar canales 2,3,4,5 (índices 1,2,3,4)
+                # Usar canales 2,3,4,5 (índices 1,2,3,4), un mic por fila (4, N).
+                # Vista sin copia: calcular_doa la vuelca centrada a su buffer contiguo float32
                 if audio_data.shape[1] >= 5:
-                    mic_data = audio_data[:, 1:5].copy()
+                    mic_data = audio_data[:, 1:5].T
                     self.calcular_doa(mic_data)
             except Exception as e:
                 print(f"Error en DOA recibir_audio: {e}")
 
+    def configurar_buffers_frame(self, n_muestras):
+        """Prepara la ventana de Hann y los buffers de trabajo para frames de n muestras"""
+        self.ventana = np.hanning(n_muestras).astype(np.float32)
+        self.frame_centrado = np.empty((4, n_muestras), dtype=np.float32)
+        self.frame_ventaneado = np.empty((4, n_muestras), dtype=np.float32)
+
     def precalcular_frecuencias(self):
         """Pre-calcula frecuencias de manera segura"""
         fft_size = self.blocksize
-        frecs = np.fft.fftfreq(fft_size, 1/self.sample_rate)
-        frecs_positivas = frecs[:fft_size//2]
+        # Bins de la FFT real (0..Nyquist), los mismos que devuelve rfft
+        frecs_positivas = np.fft.rfftfreq(fft_size, 1/self.sample_rate)
         
-        self.indices_frecuencias = []
-        self.frecuencias_reales = []
-        
-        # Procesar cada frecuencia en el rango (más simple)
-        for i, frec in enumerate(frecs_positivas):
-            if self.frec_min <= frec <= self.frec_max:
-                self.indices_frecuencias.append(i)
-                self.frecuencias_reales.append(frec)
-        
-        self.indices_frecuencias = np.array(self.indices_frecuencias)
-        self.frecuencias_reales = np.array(self.frecuencias_reales)
+        # Todas las frecuencias en el rango con una sola máscara
+        en_rango = (frecs_positivas >= self.frec_min) & (frecs_positivas <= self.frec_max)
+        self.indices_frecuencias = np.flatnonzero(en_rango)
+        self.frecuencias_reales = frecs_positivas[self.indices_frecuencias]
         
         print(f"DOA: {len(self.indices_frecuencias)} frecuencias en {self.frec_min}-{self.frec_max}Hz")
 
     def delays_precalculados(self):
         """Pre-calcula delays teóricos"""
-        delays = np.zeros((len(self.angulos), 4))
-        
-        for i, angulo_deg in enumerate(self.angulos):
-            angulo_rad = np.deg2rad(angulo_deg)
-            direccion = np.array([np.cos(angulo_rad), np.sin(angulo_rad)])
-            for mic in range(4):
-                distancia = np.dot(self.posiciones[mic], direccion)
-                delays[i, mic] = distancia / self.sound_speed
+        # Distancias proyectadas de los 4 mics para todos los ángulos en un solo producto
+        direcciones = np.stack([np.cos(self.angulos_rad), np.sin(self.angulos_rad)], axis=1)
+        delays = (direcciones @ self.posiciones.T) / self.sound_speed
                 
         return delays
 
-    def calcular_potencia_angulo(self, fft_positiva, angle_idx):
-        """Calcula potencia SRP-PHAT para un ángulo"""
-        pot = 0.0
+    def precalcular_pares(self):
+        """Pre-calcula las diferencias de retardo de cada par para todos los ángulos"""
+        self.mic1 = np.array([m1 for m1, _ in self.pares_mic], dtype=np.intp)
+        self.mic2 = np.array([m2 for _, m2 in self.pares_mic], dtype=np.intp)
+        # (ángulos, pares)
+        self.delta_tau = self.delays[:, self.mic1] - self.delays[:, self.mic2]
         
-        # Asegurar que el índice esté en rango
-        if angle_idx >= len(self.angulos):
-            angle_idx = angle_idx % len(self.angulos)
+        # Tabla de steering e^{j·2π·f·Δτ} (ángulos, pares, frecuencias), calculada una sola vez
+        # y guardada como cos/sin float32 separados para el kernel
+        fases = 2 * np.pi * self.delta_tau[:, :, np.newaxis] * self.frecuencias_reales
+        self.steering_re = np.ascontiguousarray(np.cos(fases), dtype=np.float32)
+        self.steering_im = np.ascontiguousarray(np.sin(fases), dtype=np.float32)
+        # Buffers reutilizados en cada frame: PHAT (pares, frecuencias) y potencia por ángulo
+        self.phat_re = np.zeros(self.steering_re.shape[1:], dtype=np.float32)
+        self.phat_im = np.zeros(self.steering_re.shape[1:], dtype=np.float32)
+        self.pots = np.zeros(len(self.angulos), dtype=np.float32)
         
-        for mic1, mic2 in self.pares_mic:
-            tau = self.delays[angle_idx, mic1] - self.delays[angle_idx, mic2]
-            
-            # Verificar límites del array
-            valid_indices = self.indices_frecuencias[self.indices_frecuencias < fft_positiva.shape[0]]
-            if len(valid_indices) == 0:
-                continue
-                
-            frecs_validas = self.frecuencias_reales[self.indices_frecuencias < fft_positiva.shape[0]]
-            fases_esperadas = 2 * np.pi * frecs_validas * tau
-            
-            try:
-                X1 = fft_positiva[valid_indices, mic1]
-                X2 = fft_positiva[valid_indices, mic2]
-                
-                cross = X1 * np.conj(X2)
-                magnitudes = np.abs(cross)
-                
-                mask = magnitudes > 1e-12
-                if np.any(mask):
-                    cross_phat = cross[mask] / magnitudes[mask]
-                    pot += np.sum(np.real(cross_phat * np.exp(1j * fases_esperadas[mask])))
-            except IndexError as e:
-                continue
+        # Repartir los ángulos entre núcleos solo compensa con rejillas finas (≥ 360 ángulos);
+        # con 72 el arranque de los hilos cuesta más que la propia reducción
+        n_cpu = os.cpu_count() or 1
+        self.srp_paralelo = NUMBA_DISPONIBLE and n_cpu > 1 and len(self.angulos) >= 360
+        if self.srp_paralelo:
+            # El kernel paralelo se lanza desde el hilo de audio, no desde el principal: con TBB
+            # el proceso queda colgado al salir, así que se prefieren OpenMP o workqueue
+            numba_config.THREADING_LAYER_PRIORITY = ['omp', 'workqueue', 'tbb']
+            set_num_threads(min(4, n_cpu))
         
-        return pot
+        # Calentar el kernel aquí (compilación o carga de la caché de numba) para que
+        # el primer bloque de audio no pague esa latencia dentro del callback
+        self.calcular_potencias_angulos(np.zeros((4, self.blocksize // 2 + 1), dtype=np.complex64))
+
+    def calcular_potencias_angulos(self, fft_positiva):
+        """Calcula la potencia SRP-PHAT de todos los ángulos en una sola pasada"""
+        # Solo las frecuencias útiles, en parte real e imaginaria float32 contiguas: (mics, frecuencias)
+        Xv = fft_positiva[:, self.indices_frecuencias]
+        fft_re = np.ascontiguousarray(Xv.real, dtype=np.float32)
+        fft_im = np.ascontiguousarray(Xv.imag, dtype=np.float32)
+        kernel = _potencias_srp_paralelo if self.srp_paralelo else _potencias_srp
+        return kernel(fft_re, fft_im, self.mic1, self.mic2,
+                      self.steering_re, self.steering_im,
+                      self.phat_re, self.phat_im, self.pots)
 
     def srp_phat_estable(self, audio_frame):
         """Algoritmo SRP-PHAT estabilizado"""
         try:
-            # Aplicar ventana
-            ventana = np.hanning(len(audio_frame))
-            audio_ventaneado = audio_frame * ventana[:, np.newaxis]
-            
-            # FFT segura
-            fft_data = np.fft.fft(audio_ventaneado, axis=0)
-            fft_positiva = fft_data[:len(fft_data)//2, :]
+            # Aplicar ventana (precalculada) sobre un buffer reutilizado
+            if audio_frame.shape[1] != len(self.ventana):
+                self.configurar_buffers_frame(audio_frame.shape[1])
+            audio_ventaneado = np.multiply(audio_frame, self.ventana, out=self.frame_ventaneado)
             
-            # Búsqueda simple en todos los ángulos
-            pots = np.zeros(len(self.angulos))
+            # FFT real sobre el eje contiguo (un mic por fila): solo la mitad positiva del espectro
+            # (scipy.fft reutiliza el plan entre llamadas y conserva complex64)
+            fft_positiva = sfft.rfft(audio_ventaneado, axis=1)
             
-            for i, angulo_grados in enumerate(self.angulos):
-                pots[i] = self.calcular_potencia_angulo(fft_positiva, i)
+            # Búsqueda en todos los ángulos a la vez
+            pots = self.calcular_potencias_angulos(fft_positiva)
             
             if np.max(pots) > 1e-12:
                 max_idx = np.argmax(pots)
-                angulo_estimado = self.angulos[max_idx]
+                
+                # Refinamiento parabólico con los dos vecinos (la rejilla es circular):
+                # pico sub-rejilla sin evaluar más ángulos
+                n_ang = len(self.angulos)
+                y0 = pots[(max_idx - 1) % n_ang]
+                y1 = pots[max_idx]
+                y2 = pots[(max_idx + 1) % n_ang]
+                denominador = y0 - 2 * y1 + y2
+                delta = 0.5 * (y0 - y2) / denominador if denominador < 0 else 0.0
+                angulo_estimado = round(self.angulos[max_idx] + delta * self.resolucion_grados) % 360
                 
                 # Confianza simple
                 confianza = (pots[max_idx] - np.min(pots)) / (np.max(pots) - np.min(pots) + 1e-12)
-                confianza = min(1.0, max(0.0, confianza))
+                confianza = min(1.0, max(0.0, float(confianza)))
             else:
                 angulo_estimado = self.angulo_actual
                 confianza = 0.0
@@ -183,28 +285,57 @@ class DOA:
             # Baja confianza, mantener ángulo anterior
             return self.angulo_actual, nueva_confianza * 0.5
         
-        # Agregar al buffer
+        # Si la lista ordenada quedó desfasada del deque (reinicio concurrente), reconstruirla
+        if len(self.angulos_ordenados) != len(self.buffer_angulos):
+            self.angulos_ordenados = sorted(self.buffer_angulos)
+        
+        # Agregar al buffer (el deque descarta solo el más antiguo) y a la lista ordenada
+        if len(self.buffer_angulos) == self.buffer_size:
+            viejo = self.buffer_angulos[0]
+            del self.angulos_ordenados[bisect_left(self.angulos_ordenados, viejo)]
         self.buffer_angulos.append(nuevo_angulo)
-        if len(self.buffer_angulos) > self.buffer_size:
-            self.buffer_angulos.pop(0)
+        insort(self.angulos_ordenados, nuevo_angulo)
         
         if len(self.buffer_angulos) < 3:
             return nuevo_angulo, nueva_confianza
         
         # Usar mediana del buffer
-        angulo_suavizado = int(np.median(self.buffer_angulos))
+        angulo_suavizado = int(self.mediana_circular())
         
         # Aplicar calibración
         angulo_calibrado = (angulo_suavizado + self.offset_calibracion) % 360
         
         return angulo_calibrado, nueva_confianza
 
+    def mediana_circular(self):
+        """Mediana de los ángulos del buffer respetando el salto 359°→0°"""
+        orden = self.angulos_ordenados
+        n = len(orden)
+        # Empezar tras el mayor hueco del círculo: ahí no hay datos y no se parte el grupo
+        huecos = [(orden[(i + 1) % n] - orden[i]) % 360 for i in range(n)]
+        inicio = (huecos.index(max(huecos)) + 1) % n
+        
+        def desenrollado(k):
+            j = inicio + k
+            return orden[j] if j < n else orden[j - n] + 360
+        
+        if n % 2:
+            mediana = desenrollado(n // 2)
+        else:
+            mediana = (desenrollado(n // 2 - 1) + desenrollado(n // 2)) / 2
+        return mediana % 360
+
     def calcular_doa(self, audio_frame):
         """Procesa un frame de audio de manera estable"""
         try:
-            # Pre-procesamiento básico
-            audio_filtrado = audio_frame - np.mean(audio_frame, axis=0)
-            rms = np.sqrt(np.mean(audio_filtrado**2))
+            # Pre-procesamiento básico: quitar la media por mic directamente al buffer
+            # contiguo float32 (de aquí en adelante todo es float32 y la rfft da complex64)
+            if audio_frame.shape[1] != self.frame_centrado.shape[1]:
+                self.configurar_buffers_frame(audio_frame.shape[1])
+            audio_filtrado = np.subtract(audio_frame, np.mean(audio_frame, axis=1, keepdims=True),
+                                         out=self.frame_centrado)
+            # Suma de cuadrados en una sola pasada, sin el temporal audio_filtrado**2
+            rms = np.sqrt(np.einsum('ij,ij->', audio_filtrado, audio_filtrado) / audio_filtrado.size)
             
             # Detección de actividad
             if rms > 0.005:  # Umbral de voz
@@ -275,38 +406,43 @@ class DOA:
     def update_plot(self, frame):
         """Actualiza la gráfica de manera segura"""
         try:
-            current_rad = np.deg2rad(self.angulo_actual)
+            elementos = [self.angle_line, self.arrow_head, self.angle_text, self.conf_text]
             
-            self.angle_line.set_data([current_rad, current_rad], [0, 0.9])
+            # Color según confianza: 0 rojo, 1 naranja, 2 verde
+            banda = int(self.confianza > 0.3) + int(self.confianza > 0.7)
+            estado = (self.angulo_actual, banda, round(self.confianza, 2))
             
-            arrow_x = current_rad
-            arrow_y = 0.9
+            # Sin cambios visibles: no tocar los artistas (evita recalcular textos y flecha)
+            if estado == self.ultimo_estado_plot:
+                return elementos
+            angulo_anterior, banda_anterior, _ = self.ultimo_estado_plot or (None, None, None)
+            self.ultimo_estado_plot = estado
             
-            self.arrow_head.xy = (arrow_x, arrow_y)
+            if self.angulo_actual != angulo_anterior:
+                current_rad = np.deg2rad(self.angulo_actual)
+                self.angle_line.set_data([current_rad, current_rad], [0, 0.9])
+                self.arrow_head.xy = (current_rad, 0.9)
+                self.angle_text.set_text(f'Dirección: {self.angulo_actual}°')
             
-            # Color según confianza
-            if self.confianza > 0.7:
-                color = 'green'
-            elif self.confianza > 0.3:
-                color = 'orange'
-            else:
-                color = 'red'
-                
-            self.angle_line.set_color(color)
-            self.arrow_head.arrow_patch.set_color(color)
+            if banda != banda_anterior:
+                color = self.colores_confianza[banda]
+                self.angle_line.set_color(color)
+                self.arrow_head.arrow_patch.set_color(color)
             
-            self.angle_text.set_text(f'Dirección: {self.angulo_actual}°')
             self.conf_text.set_text(f'Confianza: {self.confianza:.2f}')
             
-            return [self.angle_line, self.arrow_head, self.angle_text, self.conf_text]
+            return elementos
             
         except Exception as e:
             return []
 
     def iniciar_doa(self):
         """Inicia el sistema DOA"""
+        # Vaciar el historial antes de activar: el hilo del suscriptor no debe ver
+        # el deque y la lista ordenada a medio reiniciar
+        self.buffer_angulos.clear()
+        self.angulos_ordenados = []
         self.is_active = True
-        self.buffer_angulos = []
         print("DOA ACTIVADO")
 
     def detener_doa(self, event=None):
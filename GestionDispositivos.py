@@ -6,6 +6,7 @@ vcaa - CON CORRECCIÓN PARA OVERFLOW
 import sounddevice as sd
 import numpy as np
 import threading
+import queue
 import time
 
 class GestionDispositivos:
@@ -20,6 +21,18 @@ class GestionDispositivos:
         # ✅ MEJORA: Control de overflow
         self.callback_lock = threading.Lock()
         self.suscriptores = []
+        # Cada suscriptor procesa en su propio hilo: el callback de audio solo encola
+        self.colas_suscriptores = {}
+        # Copia inmutable de las colas para el callback: se reemplaza entera (copy-on-write)
+        # al agregar/remover, así el callback la lee sin tomar el lock
+        self.colas_activas = ()
+        self.bloques_descartados = 0
+        # Colas de suscriptores que graban: un bloque descartado ahí es un hueco en el WAV
+        self.colas_grabacion = frozenset()
+        self.descartes_por_cola = {}
+        self.last_hueco_time = 0
+        # Se activa con el primer bloque recibido: permite esperar a que el stream arranque
+        self.primer_bloque = threading.Event()
         self.overflow_counter = 0
         self.last_overflow_time = 0
         self.processing_time = 0
@@ -47,10 +60,20 @@ class GestionDispositivos:
             print(f"❌ Error buscando dispositivo: {e}")
             return False
     
-    def agregar_suscriptor(self, callback):
+    def agregar_suscriptor(self, callback, graba_audio=False):
         """Agrega un modulo que recibira el audio"""
+        # Cola corta: si el suscriptor se atrasa se descartan bloques viejos (latencia acotada).
+        # Los que graban reciben una cola de ~4 s para absorber picos sin perder audio
+        cola = queue.Queue(maxsize=64 if graba_audio else 2)
+        hilo = threading.Thread(target=self._trabajador_suscriptor, args=(callback, cola), daemon=True)
         with self.callback_lock:
             self.suscriptores.append(callback)
+            self.colas_suscriptores[callback] = cola
+            self.colas_activas = self.colas_activas + (cola,)
+            self.descartes_por_cola[cola] = 0
+            if graba_audio:
+                self.colas_grabacion = self.colas_grabacion | {cola}
+        hilo.start()
         print(f"✅ Suscriptor agregado. Total: {len(self.suscriptores)}")
     
     def remover_suscriptor(self, callback):
@@ -58,9 +81,51 @@ class GestionDispositivos:
         with self.callback_lock:
             if callback in self.suscriptores:
                 self.suscriptores.remove(callback)
+                cola = self.colas_suscriptores.pop(callback)
+                self.colas_activas = tuple(c for c in self.colas_activas if c is not cola)
+                self.colas_grabacion = self.colas_grabacion - {cola}
+                self.descartes_por_cola.pop(cola, None)
                 print(f"✅ Suscriptor removido. Total: {len(self.suscriptores)}")
             else:
                 print("⚠️ Suscriptor no encontrado")
+                return
+        # Despertar al hilo para que termine
+        self._encolar(cola, None)
+    
+    def _trabajador_suscriptor(self, callback, cola):
+        """Hilo que entrega al suscriptor los bloques encolados por el callback de audio"""
+        while True:
+            bloque = cola.get()
+            if bloque is None:
+                break
+            try:
+                callback(bloque)
+            except Exception as e:
+                print(f"❌ Error en suscriptor de audio: {e}")
+    
+    def _encolar(self, cola, bloque):
+        """Encola sin bloquear; si la cola está llena descarta el bloque más antiguo"""
+        while True:
+            try:
+                cola.put_nowait(bloque)
+                return
+            except queue.Full:
+                try:
+                    cola.get_nowait()
+                    self._registrar_descarte(cola)
+                except queue.Empty:
+                    pass
+    
+    def _registrar_descarte(self, cola):
+        """Cuenta un bloque descartado y avisa si deja un hueco en una grabacion"""
+        self.bloques_descartados += 1
+        if cola in self.descartes_por_cola:
+            self.descartes_por_cola[cola] += 1
+        if cola in self.colas_grabacion:
+            current_time = time.time()
+            if current_time - self.last_hueco_time > 2.0:  # Mostrar cada 2 segundos máximo
+                print(f"⚠️ Grabación con huecos: {self.descartes_por_cola.get(cola, 0)} bloques perdidos por un suscriptor lento")
+                self.last_hueco_time = current_time
     
     def audio_callback_central(self, indata, frames, time_info, status):
         """Unico callback que distribuye audio a todos los modulos"""
@@ -75,13 +140,19 @@ class GestionDispositivos:
                     self.last_overflow_time = current_time
         
         if self.is_recording and indata is not None:
+            if not self.primer_bloque.is_set():
+                self.primer_bloque.set()
+            
             # ✅ MEJORA: Procesamiento más eficiente
-            with self.callback_lock:
-                for suscriptor in self.suscriptores:
-                    try:
-                        suscriptor(indata.copy())
-                    except Exception as e:
-                        print(f"❌ Error en suscriptor de audio: {e}")
+            # Una sola copia por bloque (sounddevice reutiliza indata), compartida
+            # en solo lectura: el suscriptor que necesite modificarla hace su propia copia
+            bloque = indata.copy()
+            bloque.flags.writeable = False
+            # El procesamiento (FFT, SRP-PHAT, beamforming) corre en los hilos de cada
+            # suscriptor: aquí solo se encola y el callback vuelve en microsegundos.
+            # Sin lock: la lectura de la tupla es atómica y nunca se modifica in situ
+            for cola in self.colas_activas:
+                self._encolar(cola, bloque)
         
         # Medir tiempo de procesamiento
         self.processing_time = time.time() - start_time
@@ -100,6 +171,8 @@ class GestionDispositivos:
             'channels': self.channels,
             'suscriptores': len(self.suscriptores),
             'overflows': self.overflow_counter,
+            'bloques_descartados': self.bloques_descartados,
+            'bloques_perdidos_grabacion': sum(self.descartes_por_cola.get(c, 0) for c in self.colas_grabacion),
             'processing_time': self.processing_time
         }
     
@@ -169,6 +242,7 @@ class GestionDispositivos:
                 extra_settings=None  # ✅ Sin configuraciones extra que puedan causar problemas
             )
             
+            self.primer_bloque.clear()
             self.is_recording = True
             self.stream.start()
             
@@ -187,6 +261,10 @@ class GestionDispositivos:
             self.is_recording = False
             return False
     
+    def esperar_primer_bloque(self, timeout=2.0):
+        """Espera a que el callback entregue el primer bloque de audio"""
+        return self.primer_bloque.wait(timeout)
+    
     def pausar_captura(self):
         """Pausa la captura de audio temporalmente"""
         if self.stream and self.is_recording:
@@ -217,6 +295,11 @@ class GestionDispositivos:
                 print("🛑 Captura de audio detenida completamente")
                 if self.overflow_counter > 0:
                     print(f"   - Overflows totales: {self.overflow_counter}")
+                if self.bloques_descartados > 0:
+                    print(f"   - Bloques descartados por suscriptores lentos: {self.bloques_descartados}")
+                perdidos = sum(self.descartes_por_cola.get(c, 0) for c in self.colas_grabacion)
+                if perdidos > 0:
+                    print(f"   - ⚠️ Bloques perdidos en grabaciones (huecos en el WAV): {perdidos}")
             except Exception as e:
                 print(f"⚠️ Error cerrando stream: {e}")
     
@@ -9,7 +9,59 @@ import matplotlib.animation as animation
 from matplotlib.widgets import Button
 import time
 import os
-from scipy.io.wavfile import write
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import wave
+from contextlib import ExitStack
+
+try:
+    from numba import njit
+    NUMBA_DISPONIBLE = True
+except ImportError:
+    NUMBA_DISPONIBLE = False
+
+
+def _amplificar_en_anillo_numpy(audio, anillo, head, escala, canal_inicio):
+    """Escribe los canales amplificados en el buffer circular; devuelve la nueva cabeza"""
+    largo, canales = anillo.shape
+    bloque = audio[-largo:, canal_inicio:canal_inicio + canales]
+    n = len(bloque)
+    primero = min(n, largo - head)
+    np.multiply(bloque[:primero], escala, out=anillo[head:head + primero])
+    if primero < n:
+        np.multiply(bloque[primero:], escala, out=anillo[:n - primero])
+    return (head + n) % largo
+
+
+if NUMBA_DISPONIBLE:
+    @njit(cache=True, nogil=True, boundscheck=False)
+    def _amplificar_en_anillo(audio, anillo, head, escala, canal_inicio):
+        """Amplificación y escritura circular en una sola pasada, sin temporales"""
+        largo, canales = anillo.shape
+        n = audio.shape[0]
+        inicio = n - largo if n > largo else 0
+        for i in range(inicio, n):
+            for c in range(canales):
+                anillo[head, c] = audio[i, canal_inicio + c] * escala
+            head += 1
+            if head == largo:
+                head = 0
+        return head
+else:
+    _amplificar_en_anillo = _amplificar_en_anillo_numpy
+
+
+if NUMBA_DISPONIBLE:
+    @njit(cache=True, nogil=True, boundscheck=False)
+    def _escalar_a_int16(src, dst):
+        """Escala a 16 bits, satura y redondea en una pasada (corre en el hilo de guardado)"""
+        for i in range(src.shape[0]):
+            for c in range(src.shape[1]):
+                # Todo en float32 (sin promoción a float64) para que LLVM lo vectorice
+                v = src[i, c] * np.float32(32767.0)
+                v = min(max(v, np.float32(-32768.0)), np.float32(32767.0))
+                dst[i, c] = np.int16(np.rint(v))
+
 
 class MicrophoneArrayRealtime:
     def __init__(self, gestion_audio):
@@ -17,11 +69,6 @@ class MicrophoneArrayRealtime:
         self.sample_rate = 16000
         self.channels = 4
         
-        # Buffers
-        self.audio_buffer = []
-        self.full_audio_buffer = []
-        self.running = True
-        
         # Configuracion de graficos
         self.fig = None
         self.axs = None
@@ -31,25 +78,81 @@ class MicrophoneArrayRealtime:
         
         self.amplification_factor = 15.0
         
+        # Buffers
+        # Buffer circular fijo para la grafica (ya amplificado): no crece con la grabacion
+        self.plot_ring = np.zeros((self.window_samples, self.channels), dtype=np.float32)
+        self.write_head = 0
+        self.muestras_en_ring = 0
+        # (write_head, muestras_en_ring) del último bloque completo, publicados juntos para la GUI
+        self.posicion_visual = (0, 0)
+        # Marca de audio nuevo desde el último refresco de la gráfica
+        self.buffers_modificados = False
+        # Ventana desenrollada en orden temporal, reutilizada en cada frame
+        self.plot_buffer = np.zeros((self.window_samples, self.channels), dtype=np.float32)
+        # Grabacion completa (sin amplificar) en bloques fijos de 10 s: agregar audio es
+        # copiar en el bloque activo y solo se reserva memoria cada 10 s
+        self.muestras_por_bloque = self.sample_rate * 10
+        self.bloques_grabacion = [self._nuevo_bloque_grabacion()]
+        self.pos_grabacion = 0
+        self.grabacion_lock = threading.Lock()
+        self.running = True
+        
+        # Calentar el kernel (compilación o caché de numba) antes del primer bloque de audio,
+        # con un bloque de solo lectura como los que entrega GestionDispositivos
+        bloque_prueba = np.zeros((1, self.channels + 1), dtype=np.float32)
+        bloque_prueba.flags.writeable = False
+        _amplificar_en_anillo(bloque_prueba, self.plot_ring, 0, self.amplification_factor, 1)
+        
         # Configuracion de guardado
         self.output_folder = r"C:\Users\leona\Desktop\TLTech\PFJdN\Audios_Crudos"
         os.makedirs(self.output_folder, exist_ok=True)
+        # Por defecto solo el WAV de 4 canales: cada micrófono se extrae de él
+        # (p. ej. wavfile.read(ruta)[1][:, i]); activar para escribir además un WAV por mic
+        self.guardar_por_canal = False
+        # Escritura a disco en un hilo aparte: la GUI no se congela mientras se guarda
+        self.executor_guardado = ThreadPoolExecutor(max_workers=1)
         
         # Registrarse para recibir audio
-        self.gestion_audio.agregar_suscriptor(self.recibir_audio)
+        self.gestion_audio.agregar_suscriptor(self.recibir_audio, graba_audio=True)
         
         print(f"PDG inicializado - Amplificacion: {self.amplification_factor}x")
 
     def recibir_audio(self, audio_data):
         """Callback que recibe audio del gestor central"""
         if self.running and audio_data is not None:
-            amplified_data = audio_data[:, 1:5].copy()
-            
-            for ch in range(4):
-                amplified_data[:, ch] = amplified_data[:, ch] * self.amplification_factor
+            # Microfonos 1-4 (columnas 1:5) amplificados directo al buffer circular
+            self.write_head = _amplificar_en_anillo(audio_data, self.plot_ring, self.write_head,
+                                                    self.amplification_factor, 1)
+            self.muestras_en_ring = min(self.muestras_en_ring + len(audio_data), self.window_samples)
+            # Publicar cabeza y llenado de una vez (asignación atómica): la GUI lee un par
+            # coherente sin locks y nunca ve un bloque a medio escribir como válido
+            self.posicion_visual = (self.write_head, self.muestras_en_ring)
+            self.buffers_modificados = True
             
-            self.audio_buffer.append(amplified_data)
-            self.full_audio_buffer.append(audio_data[:, 1:5].copy())
+            self._agregar_a_grabacion(audio_data[:, 1:5])
+
+    def _nuevo_bloque_grabacion(self):
+        """Reserva un bloque vacío de la grabación completa"""
+        return np.empty((self.muestras_por_bloque, self.channels), dtype=np.float32)
+
+    def _agregar_a_grabacion(self, datos):
+        """Copia el audio crudo al bloque activo, abriendo uno nuevo cuando se llena"""
+        with self.grabacion_lock:
+            while len(datos) > 0:
+                n = min(len(datos), self.muestras_por_bloque - self.pos_grabacion)
+                self.bloques_grabacion[-1][self.pos_grabacion:self.pos_grabacion + n] = datos[:n]
+                self.pos_grabacion += n
+                datos = datos[n:]
+                if self.pos_grabacion == self.muestras_por_bloque:
+                    self.bloques_grabacion.append(self._nuevo_bloque_grabacion())
+                    self.pos_grabacion = 0
+
+    def _bloques_grabados(self):
+        """Vistas de la grabación completa hasta el momento (el último bloque recortado)"""
+        with self.grabacion_lock:
+            bloques = self.bloques_grabacion[:-1]
+            bloques.append(self.bloques_grabacion[-1][:self.pos_grabacion])
+        return bloques
 
     def setup_graficos(self):
         """Configuracion de graficos - Microfonos 1,2,3,4"""
@@ -59,6 +162,9 @@ class MicrophoneArrayRealtime:
         
         colores = ['blue', 'red', 'green', 'orange']
         
+        # Eje de tiempo fijo: se calcula una vez y cada frame solo cambia la amplitud
+        self.tiempo_ventana = np.linspace(0, self.window_duration, self.window_samples)
+        
         # Configurar los 4 microfonos
         for i in range(4):
             mic_numero = i + 1
@@ -89,65 +195,140 @@ class MicrophoneArrayRealtime:
 
         # ✅ CORRECCIÓN: Usar adjust en lugar de tight_layout
         plt.subplots_adjust(left=0.08, right=0.95, top=0.93, bottom=0.08, hspace=0.4)
+        
+        # La resolución de la decimación depende del ancho en pixeles de los ejes
+        self.configurar_decimacion()
+        self.fig.canvas.mpl_connect('resize_event', self.configurar_decimacion)
+
+    def configurar_decimacion(self, event=None):
+        """Ajusta la decimación min/max al ancho en pixeles de los ejes"""
+        ancho_px = max(1, int(self.axs[0].get_window_extent().width))
+        self.muestras_por_pixel = max(1, self.window_samples // ancho_px)
+        n_pixeles = self.window_samples // self.muestras_por_pixel
+        # Las muestras sobrantes (las más antiguas) quedan fuera de la decimación
+        self.inicio_decimado = self.window_samples - n_pixeles * self.muestras_por_pixel
+        
+        # Por pixel se dibujan dos puntos (mínimo y máximo) en el centro del intervalo
+        centros = self.tiempo_ventana[self.inicio_decimado:].reshape(n_pixeles, -1).mean(axis=1)
+        self.tiempo_decimado = np.repeat(centros, 2)
+        self.y_decimado = np.zeros((2 * n_pixeles, self.channels), dtype=np.float32)
+        # Vistas por canal fijas mientras no cambie el tamaño: el frame no crea ninguna
+        self.vistas_canales = [self.y_decimado[:, i] for i in range(self.channels)]
+        for line, y in zip(self.lines, self.vistas_canales):
+            line.set_data(self.tiempo_decimado, y)
+        # Los buffers nuevos están en cero: recalcular en el próximo frame
+        self.buffers_modificados = True
 
     def update_plot(self, frame):
         """Actualiza graficos en tiempo real"""
-        if not self.running or len(self.audio_buffer) == 0:
+        # Sin audio nuevo (dispositivo pausado o atrasado), mantener las líneas actuales
+        if not self.running or not self.buffers_modificados:
+            return self.lines
+        self.buffers_modificados = False
+        
+        head, muestras = self.posicion_visual
+        if muestras == 0:
             return self.lines
 
         try:
-            if len(self.audio_buffer) > 0:
-                all_data = np.concatenate(self.audio_buffer, axis=0)
-                
-                if len(all_data) > self.window_samples:
-                    all_data = all_data[-self.window_samples:]
-                
-                current_time = np.linspace(max(0, self.window_duration - len(all_data)/self.sample_rate), 
-                                         self.window_duration, len(all_data))
+            # Desenrollar el buffer circular (más antiguo primero) sin asignar memoria,
+            # desde la última posición publicada. Mientras la ventana no se llena,
+            # el inicio queda en cero
+            cola = self.window_samples - head
+            self.plot_buffer[:cola] = self.plot_ring[head:]
+            self.plot_buffer[cola:] = self.plot_ring[:head]
+            
+            # Decimación min/max: ~2 puntos por pixel en vez de 48000 por línea,
+            # conservando los picos de la señal
+            pixeles = self.plot_buffer[self.inicio_decimado:].reshape(-1, self.muestras_por_pixel, self.channels)
+            np.min(pixeles, axis=1, out=self.y_decimado[0::2])
+            np.max(pixeles, axis=1, out=self.y_decimado[1::2])
+            
+            # Actualizar microfonos 1,2,3,4
+            for line, y in zip(self.lines, self.vistas_canales):
+                line.set_ydata(y)
                 
-                # Actualizar microfonos 1,2,3,4
-                for i in range(4):
-                    if all_data.shape[1] > i:
-                        self.lines[i].set_data(current_time, all_data[:, i])
-                    
         except Exception as e:
             print(f"Error actualizando graficos PDG: {e}")
 
         return self.lines
 
     def guardar_audio_completo(self, event=None):
-        """Guarda el audio completo de los microfonos 1,2,3,4"""
+        """Guarda el audio completo de los microfonos 1,2,3,4 (la escritura se hace en segundo plano)"""
         print("\nGuardando audio desde PDG...")
         
-        if len(self.full_audio_buffer) == 0:
+        # Los bloques llenos ya no cambian y el último solo crece más allá del recorte:
+        # la grabación puede seguir mientras se escribe, sin copiar nada
+        bloques = self._bloques_grabados()
+        if sum(len(b) for b in bloques) == 0:
             print("Error: No hay datos de audio para guardar")
-            return
+            return None
 
-        try:
-            audio_data = np.concatenate(self.full_audio_buffer, axis=0)
-            audio_int16 = np.int16(audio_data * 32767)
+        timestamp = time.strftime("%Y%m%d_%H%M%S")
+        return self.executor_guardado.submit(self._escribir_grabacion, bloques, timestamp)
 
-            timestamp = time.strftime("%Y%m%d_%H%M%S")
+    def _escribir_grabacion(self, bloques, timestamp):
+        """Convierte a int16 y escribe los WAV por bloques, sin armar la grabación entera (hilo de guardado)"""
+        try:
+            # Prefijo armado una sola vez (sin .format(): la carpeta puede tener llaves)
+            prefijo = os.path.join(self.output_folder, timestamp)
+            all_channels_path = f"{prefijo}_todos_canales.wav"
+            # Microfonos individuales opcionales, escritos en la misma pasada
+            rutas_mic = [f"{prefijo}_mic_{i + 1}.wav" for i in range(4)] if self.guardar_por_canal else []
+            
+            # Buffers de un bloque de 10 s reutilizados: la memoria no crece con la duración
+            muestras_max = max(len(b) for b in bloques)
+            bloque_int16 = np.empty((muestras_max, self.channels), dtype=np.int16)
+            canal = np.empty(muestras_max, dtype=np.int16)
+            tmp = None if NUMBA_DISPONIBLE else np.empty((muestras_max, self.channels), dtype=np.float32)
             
-            # Guardar microfonos individuales
-            for i in range(4):
-                mic_numero = i + 1
-                filepath = os.path.join(self.output_folder, f"mic_{mic_numero}_{timestamp}.wav")
-                write(filepath, self.sample_rate, audio_int16[:, i])
-                print(f"Guardado: {filepath}")
-
-            # Guardar todos los canales
-            all_channels_path = os.path.join(self.output_folder, f"todos_canales_{timestamp}.wav")
-            write(all_channels_path, self.sample_rate, audio_int16)
+            with ExitStack() as pila:
+                multicanal = self._abrir_wav(pila, all_channels_path, self.channels)
+                por_canal = [self._abrir_wav(pila, ruta, 1) for ruta in rutas_mic]
+                
+                for bloque in bloques:
+                    n = len(bloque)
+                    destino = bloque_int16[:n]
+                    self._convertir_a_int16(bloque, destino, tmp)
+                    multicanal.writeframesraw(destino)
+                    # Cada canal se copia a un buffer contiguo antes de escribirlo
+                    for i, wav in enumerate(por_canal):
+                        np.copyto(canal[:n], destino[:, i])
+                        wav.writeframesraw(canal[:n])
+            
+            for ruta in rutas_mic:
+                print(f"Guardado: {ruta}")
             print(f"Guardado multicanales: {all_channels_path}")
 
-            duracion_total = len(audio_data) / self.sample_rate
+            duracion_total = sum(len(b) for b in bloques) / self.sample_rate
             print(f"Duracion TOTAL: {duracion_total:.2f} segundos")
             print(f"Amplificacion aplicada: {self.amplification_factor}x")
             
         except Exception as e:
             print(f"Error guardando audio PDG: {e}")
 
+    def _abrir_wav(self, pila, ruta, canales):
+        """Abre un WAV PCM de 16 bits con buffer de 4 MB; la pila lo cierra (y completa la cabecera)"""
+        archivo = pila.enter_context(open(ruta, 'wb', buffering=4 << 20))
+        wav = pila.enter_context(wave.open(archivo, 'wb'))
+        wav.setnchannels(canales)
+        wav.setsampwidth(2)
+        wav.setframerate(self.sample_rate)
+        return wav
+
+    def _convertir_a_int16(self, bloque, destino, tmp=None):
+        """Escala, satura, redondea y convierte un bloque a int16 sobre destino"""
+        # Con numba se escribe directo en el destino; sin numba hace falta un temporal float32
+        if NUMBA_DISPONIBLE:
+            _escalar_a_int16(bloque, destino)
+        else:
+            t = tmp[:len(bloque)]
+            np.multiply(bloque, 32767.0, out=t)
+            np.clip(t, -32768.0, 32767.0, out=t)
+            np.rint(t, out=t)  # Redondeo al entero más cercano en lugar de truncar
+            destino[:] = t
+        return destino
+
     def detener_visualizacion(self, event=None):
         """Detiene la visualizacion"""
         print("\nCerrando PDG...")
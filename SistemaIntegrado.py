@@ -3,7 +3,18 @@ SISTEMA INTEGRADO - Versión Estable y Corregida
 vcaa - SIN ERRORES DE ÍNDICE
 """
 
-import time
+import matplotlib
+# Backend interactivo fijado antes de importar pyplot; si Qt no está, se usa Tk.
+# use() no valida el backend hasta importar pyplot, por eso se importa antes
+try:
+    import matplotlib.backends.backend_qtagg
+    matplotlib.use('QtAgg')
+except ImportError:
+    try:
+        import matplotlib.backends.backend_tkagg
+        matplotlib.use('TkAgg')
+    except ImportError:
+        pass
 import matplotlib.pyplot as plt
 from matplotlib.animation import FuncAnimation
 from GestionDispositivos import GestionDispositivos
@@ -12,6 +23,14 @@ from DOA import DOA
 from Beamforming import BeamformingSystem
 from CalibracionDOA import CalibradorDOA
 
+# Menos trabajo de dibujo por frame en las animaciones: sin barra de herramientas
+# (cada figura ya tiene sus botones), simplificación de trazos a nivel de pixel
+# y trazos largos divididos en tramos para Agg
+matplotlib.rcParams['toolbar'] = 'None'
+matplotlib.rcParams['path.simplify'] = True
+matplotlib.rcParams['path.simplify_threshold'] = 1.0
+matplotlib.rcParams['agg.path.chunksize'] = 10000
+
 class SistemaIntegrado:
     def __init__(self):
         print("=" * 60)
@@ -47,7 +66,10 @@ class SistemaIntegrado:
                 print("❌ Error: Falló la captura de audio")
                 return False
             
-            time.sleep(1.0)  # Tiempo para estabilizar el audio
+            # Esperar al primer bloque real en lugar de una pausa fija
+            if not self.gestion_audio.esperar_primer_bloque(timeout=2.0):
+                print("❌ Error: La captura no entregó audio")
+                return False
             
             # 2. Pregunta simple de calibración
             print("\n" + "="*40)
@@ -74,8 +96,6 @@ class SistemaIntegrado:
             self.doa.iniciar_doa()
             self.beamforming.iniciar_beamforming()
             
-            time.sleep(0.5)  # Pequeña pausa para estabilizar
-            
             # 4. Configurar visualizaciones
             print("3. Configurando visualizaciones...")
             if not self.configurar_visualizaciones():
@@ -102,8 +122,18 @@ class SistemaIntegrado:
             print(f"   - Canales activos: {estado['channels']}")
             print(f"   - Suscriptores: {estado['suscriptores']}")
             
+            print("\n💡 Sistema ejecutándose...")
+            print("   Cierra las ventanas o presiona Ctrl+C para detener")
+            
+            # Bloquea hasta que se cierran todas las ventanas
             plt.show()
+            # En modo interactivo show() vuelve enseguida: esperar a que se cierren
+            if plt.isinteractive():
+                while plt.get_fignums():
+                    plt.pause(0.5)
             
+            print("\n⚠️ Ventanas cerradas - deteniendo sistema...")
+            self.sistema_activo = False
             return True
             
         except Exception as e:
@@ -112,6 +142,14 @@ class SistemaIntegrado:
             traceback.print_exc()
             return False
 
+    def _animar(self, fig, funcion, intervalo):
+        """Crea y registra una animación con la configuración común de todas las vistas"""
+        # Blitting (solo se redibujan los artistas devueltos) y sin guardar frames
+        ani = FuncAnimation(fig, funcion, interval=intervalo, blit=True,
+                            cache_frame_data=False, save_count=0)
+        self.animaciones.append(ani)
+        return ani
+
     def configurar_visualizaciones(self):
         """Configura todas las visualizaciones del sistema"""
         try:
@@ -120,11 +158,7 @@ class SistemaIntegrado:
             # PDG - Visualización de micrófonos
             try:
                 self.pdg.setup_graficos()
-                ani_pdg = FuncAnimation(
-                    self.pdg.fig, self.pdg.update_plot, 
-                    interval=50, blit=False, cache_frame_data=False
-                )
-                self.animaciones.append(ani_pdg)
+                self._animar(self.pdg.fig, self.pdg.update_plot, 50)
                 print("   ✅ PDG configurado")
                 success_count += 1
             except Exception as e:
@@ -132,11 +166,7 @@ class SistemaIntegrado:
             
             # DOA - Localización
             try:
-                ani_doa = FuncAnimation(
-                    self.doa.fig, self.doa.update_plot,
-                    interval=100, blit=False, cache_frame_data=False
-                )
-                self.animaciones.append(ani_doa)
+                self._animar(self.doa.fig, self.doa.update_plot, 100)
                 print("   ✅ DOA configurado")
                 success_count += 1
             except Exception as e:
@@ -165,11 +195,7 @@ class SistemaIntegrado:
             
             if hasattr(self.beamforming, 'configurar_visualizacion'):
                 if self.beamforming.configurar_visualizacion(self.fig_bf):
-                    ani_bf = FuncAnimation(
-                        self.fig_bf, self.beamforming.update_plot,
-                        interval=150, blit=False, cache_frame_data=False
-                    )
-                    self.animaciones.append(ani_bf)
+                    self._animar(self.fig_bf, self.beamforming.update_plot, 150)
                     return True
             return False
             
@@ -315,33 +341,13 @@ def main():
             print("❌ No se pudo inicializar el sistema de audio")
             return
         
-        # Iniciar sistema
+        # Iniciar sistema: vuelve cuando se cierran todas las ventanas
         if not sistema.iniciar_sistema():
             print("❌ Fallo al iniciar el sistema")
             return
         
-        # Mantener el sistema activo
-        print("\n💡 Sistema ejecutándose...")
-        print("   Presiona Ctrl+C para detener")
-        
-        # Loop principal simple
-        while sistema.sistema_activo:
-            try:
-                time.sleep(1)
-                # Verificar si las ventanas siguen abiertas
-                if not plt.get_fignums():
-                    print("\n⚠️ Ventanas cerradas - deteniendo sistema...")
-                    break
-                    
-            except KeyboardInterrupt:
-                print("\n\n⚠️ Interrupción por usuario")
-                break
-            except Exception as e:
-                print(f"\n⚠️ Error en loop principal: {e}")
-                break
-        
     except KeyboardInterrupt:
-        print("\n\n⚠️ Sistema interrumpido durante inicio")
+        print("\n\n⚠️ Interrupción por usuario")
     except Exception as e:
         print(f"\n❌ Error inesperado: {e}")
         import traceback